@@ -86,5 +86,8 @@ def multi_agent_orchestration(topic: str, angle: str = None) -> dict:
     - Editor Agent: Reviews and refines
     """
     # TODO: Implement full multi-agent system
-    # This is a placeholder for future enhancement
+    # This is a placeholder for future enhancement.
+    # When the Research/Analysis/Editor passes land, issue their queries
+    # together through rag.batch_retrieve so the index is searched once
+    # per round instead of once per agent.
     pass
\ No newline at end of file
@@ -2,15 +2,46 @@
 
 import streamlit as st
 from rag import (
-    load_pdf_text, split_into_chunks, fetch_wikipedia,
-    build_vectorstore_from_docs, generate_article_from_retriever
+    load_pdf_text, split_into_chunks,
+    build_vectorstore_from_docs, build_vectorstore_for_topic,
+    generate_article_from_retriever, EMBED_MODEL
 )
 from agents import two_agent_pipeline
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import Document
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+# Render LLM tokens into a placeholder as they arrive, so the article
+# appears progressively instead of after the full generation
+class StreamHandler(BaseCallbackHandler):
+    def __init__(self, container):
+        self.container = container
+        self.text = ""
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.text += token
+        self.container.markdown(self.text + "▌")
+
+
+# Cache the FAISS index per (chunk texts, embedding model) so re-clicking
+# Generate with the same source skips embedding and indexing entirely
+@st.cache_resource(show_spinner=False)
+def cached_vectorstore(chunk_texts: tuple, model: str):
+    docs = [Document(page_content=t) for t in chunk_texts]
+    return build_vectorstore_from_docs(docs)
+
+
+# Wikipedia path: the pipelined builder overlaps page downloads with
+# chunk embedding, cached per (topic, pages, model)
+@st.cache_resource(show_spinner=False)
+def cached_topic_vectorstore(topic: str, max_pages: int, model: str):
+    return build_vectorstore_for_topic(topic, max_pages)
+
+
 # Page configuration
 st.set_page_config(
     page_title="GenAI Newspaper Generator", 
@@ -167,42 +198,47 @@ if st.button("🚀 Generate Article", type="primary", use_container_width=True):
             # Standard RAG pipeline
             with st.spinner("🔍 Building context and generating article..."):
                 try:
-                    docs = []
-                    
+                    vectorstore = None
+
                     if mode == "Wikipedia search":
-                        wiki_text = fetch_wikipedia(topic, max_pages=num_pages)
-                        if not wiki_text:
+                        vectorstore = cached_topic_vectorstore(topic, num_pages, EMBED_MODEL)
+                        if vectorstore is None:
                             st.error("No Wikipedia content found for that topic.")
                         else:
                             st.success(f"✅ Fetched {num_pages} Wikipedia pages")
-                            docs = split_into_chunks(wiki_text)
                     else:
                         # Handle uploaded files
-                        all_text = ""
+                        parts = []
                         for up in uploaded_docs:
                             if up.type == "application/pdf":
-                                # Save temporarily
-                                temp_path = f"temp_{up.name}"
-                                with open(temp_path, "wb") as f:
-                                    f.write(up.getbuffer())
-                                txt = load_pdf_text(temp_path)
-                                all_text += "\n\n" + txt
-                                os.remove(temp_path)  # Clean up
+                                # Parse in memory, no temp file needed
+                                parts.append(load_pdf_text(up.getvalue()))
                             else:
-                                text = up.getvalue().decode("utf-8")
-                                all_text += "\n\n" + text
+                                parts.append(up.getvalue().decode("utf-8"))
+                        all_text = "\n\n".join(parts)
                         docs = split_into_chunks(all_text)
-                        st.success(f"✅ Processed {len(docs)} text chunks")
-                    
-                    if docs:
-                        with st.spinner("🧮 Creating vector embeddings..."):
-                            retriever = build_vectorstore_from_docs(docs).as_retriever(
-                                search_type="similarity", 
-                                search_kwargs={"k": 4}
-                            )
-                        
+                        if not docs:
+                            st.error("No text could be extracted from the uploaded file(s).")
+                        else:
+                            st.success(f"✅ Processed {len(docs)} text chunks")
+                            with st.spinner("🧮 Creating vector embeddings..."):
+                                vectorstore = cached_vectorstore(
+                                    tuple(d.page_content for d in docs), EMBED_MODEL
+                                )
+
+                    if vectorstore is not None:
+                        retriever = vectorstore.as_retriever(
+                            search_type="similarity",
+                            search_kwargs={"k": 4}
+                        )
+
                         with st.spinner("✍️ Generating article with GPT-4..."):
-                            article = generate_article_from_retriever(retriever, topic)
+                            stream_box = st.empty()
+                            article = generate_article_from_retriever(
+                                retriever, topic,
+                                callbacks=[StreamHandler(stream_box)]
+                            )
+                            stream_box.empty()
                             st.session_state.article = article
                             st.session_state.mode = "rag"
                 
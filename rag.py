@@ -1,90 +1,470 @@
 # rag.py
+import asyncio
+import hashlib
 import os
 import wikipedia
-from typing import List
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Union
 from dotenv import load_dotenv
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from langchain.embeddings import OpenAIEmbeddings
+import faiss
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.embeddings import CacheBackedEmbeddings, OpenAIEmbeddings
+from langchain.storage import LocalFileStore
 from langchain.vectorstores import FAISS
-from langchain.chains import RetrievalQA
+from langchain.vectorstores.utils import DistanceStrategy
 from langchain.chat_models import ChatOpenAI
-from PyPDF2 import PdfReader
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnablePassthrough
+import fitz  # PyMuPDF
 
 load_dotenv()
 
 # Environment
 EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
+EMBED_DIM = int(os.getenv("EMBED_DIM", 512))
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 200))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 512))
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "./.emb_cache")
+HNSW_M = int(os.getenv("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 64))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 32))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 64))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.97))
+
+# --------------------------------------------------------
+# 🔌 Shared OpenAI Clients
+# --------------------------------------------------------
+# Lazy singletons: one embeddings client and one chat client per process,
+# so the underlying HTTP connections stay pooled (keep-alive) across
+# calls instead of paying a TLS handshake every time. Construction is
+# deferred so importing rag.py works without OPENAI_API_KEY set.
+@lru_cache(maxsize=1)
+def _get_embeddings() -> CacheBackedEmbeddings:
+    # query_embedding_cache=True caches embed_query results in the same
+    # byte store, so repeated semantic-cache lookups skip the API too
+    return CacheBackedEmbeddings.from_bytes_store(
+        OpenAIEmbeddings(model=EMBED_MODEL, dimensions=EMBED_DIM),
+        LocalFileStore(EMBED_CACHE_DIR),
+        namespace=f"{EMBED_MODEL}-{EMBED_DIM}",
+        query_embedding_cache=True,
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_llm() -> ChatOpenAI:
+    # streaming=True lets callers watch tokens arrive; without a token
+    # callback the response is still returned whole
+    return ChatOpenAI(model=MODEL, temperature=0.4, streaming=True)
+
 
 # --------------------------------------------------------
 # 🔍 Wikipedia Fetch
 # --------------------------------------------------------
-def fetch_wikipedia(topic: str, max_pages: int = 3) -> str:
-    """Fetch and concatenate multiple Wikipedia pages"""
+@lru_cache(maxsize=512)
+def _fetch_page(title: str) -> str:
+    """Fetch a single Wikipedia page's content, cached per title.
+
+    Only genuine no-content outcomes (missing or ambiguous pages) are
+    cached as ""; network errors propagate, so lru_cache records nothing
+    and the next call retries.
+    """
     try:
-        results = wikipedia.search(topic, results=max_pages)
-        content = []
-        for r in results:
-            try:
-                page = wikipedia.page(r)
-                content.append(page.content)
-            except Exception:
-                continue
-        return "\n\n".join(content)
-    except Exception as e:
-        print(f"❌ Wikipedia fetch failed: {e}")
+        return wikipedia.page(title).content
+    except (wikipedia.PageError, wikipedia.DisambiguationError):
+        return ""
+
+
+@lru_cache(maxsize=128)
+def fetch_wikipedia(topic: str, max_pages: int = 3) -> str:
+    """Fetch and concatenate multiple Wikipedia pages (memoized per topic).
+
+    Transient search or fetch failures raise instead of being memoized
+    as empty results.
+    """
+    results = wikipedia.search(topic, results=max_pages)
+    if not results:
         return ""
+    # Each page is an independent HTTPS call, so fetch them concurrently
+    with ThreadPoolExecutor(max_workers=len(results)) as ex:
+        content = [c for c in ex.map(_fetch_page, results) if c]
+    return "\n\n".join(content)
 
 # --------------------------------------------------------
 # 📄 PDF Reader
 # --------------------------------------------------------
-def load_pdf_text(path: str) -> str:
-    """Extracts raw text from a PDF file"""
-    text = ""
-    with open(path, "rb") as f:
-        pdf = PdfReader(f)
-        for page in pdf.pages:
-            text += page.extract_text() or ""
-    return text
+def load_pdf_text(source: Union[str, bytes]) -> str:
+    """Extracts raw text from a PDF file path or in-memory PDF bytes"""
+    if isinstance(source, (bytes, bytearray)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source)
+    with doc:
+        return "".join(page.get_text() for page in doc)
 
 # --------------------------------------------------------
 # ✂️ Chunking
 # --------------------------------------------------------
+# Built once at import: sizes chunks in tokens (the embedder's budget)
+# rather than characters, and avoids re-loading the tiktoken encoder
+# on every call
+_SPLITTER = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+    encoding_name="cl100k_base",
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+)
+
+
 def split_into_chunks(text: str) -> List[Document]:
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
-    )
-    docs = splitter.create_documents([text])
-    return docs
+    return _SPLITTER.create_documents([text])
 
 # --------------------------------------------------------
 # 🧠 Vectorstore Builder
 # --------------------------------------------------------
 def build_vectorstore_from_docs(docs: List[Document]) -> FAISS:
-    embeddings = OpenAIEmbeddings(model=EMBED_MODEL)
-    vectorstore = FAISS.from_documents(docs, embeddings)
+    """Embed all chunks in large batches and build a FAISS index.
+
+    Batching sends one embeddings request per EMBED_BATCH_SIZE chunks
+    (instead of many small calls), and the batches run concurrently so
+    the network round-trips overlap. Vectors are cached on disk keyed by
+    chunk content and EMBED_MODEL, so re-runs over the same text only
+    embed cache misses.
+    """
+    embeddings = _get_embeddings()
+    texts = [d.page_content for d in docs]
+    batches = [
+        texts[i : i + EMBED_BATCH_SIZE]
+        for i in range(0, len(texts), EMBED_BATCH_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(batches)))) as ex:
+        vectors = [
+            v for batch_vectors in ex.map(embeddings.embed_documents, batches)
+            for v in batch_vectors
+        ]
+    return _vectorstore_from_vectors(docs, vectors)
+
+
+def _vectorstore_from_vectors(docs: List[Document], vectors: List[List[float]]) -> FAISS:
+    """Wrap pre-computed chunk vectors in a FAISS vectorstore."""
+    vecs = np.asarray(vectors, dtype=np.float32)
+
+    # OpenAI embeddings are unit-normalized, so cosine similarity equals
+    # the inner product; scoring with METRIC_INNER_PRODUCT skips the L2
+    # path's extra norm terms. Normalizing the stored side is defensive;
+    # queries need no normalization since inner-product ranking is
+    # invariant to query scaling.
+    faiss.normalize_L2(vecs)
+
+    # HNSW (graph-based ANN) gives ~log(N) queries vs the flat index's
+    # exhaustive O(N·d) scan that FAISS.from_documents would default to;
+    # the int8 scalar quantizer stores vectors at a quarter of the
+    # float32 footprint and scans with SIMD int8 dot products
+    index = faiss.IndexHNSWSQ(
+        vecs.shape[1], faiss.ScalarQuantizer.QT_8bit, HNSW_M,
+        faiss.METRIC_INNER_PRODUCT,
+    )
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    index.train(vecs)
+    index.add(vecs)
+
+    ids = [str(i) for i in range(len(docs))]
+    docstore = InMemoryDocstore(dict(zip(ids, docs)))
+    vectorstore = FAISS(
+        embedding_function=_get_embeddings().embed_query,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids)),
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
     return vectorstore
 
+
+async def _gather_topic_vectors(topic: str, max_pages: int):
+    """Download pages and embed their chunks concurrently.
+
+    Each page's chunks are sent to the embeddings API as soon as that
+    page finishes downloading, so embedding overlaps the remaining
+    downloads instead of waiting for all of them.
+    """
+    results = wikipedia.search(topic, results=max_pages)
+    loop = asyncio.get_running_loop()
+    embeddings = _get_embeddings()
+    fetches = [loop.run_in_executor(None, _fetch_page, r) for r in results]
+    docs: List[Document] = []
+    embed_tasks = []
+    for fut in asyncio.as_completed(fetches):
+        page_text = await fut
+        if not page_text:
+            continue
+        page_docs = split_into_chunks(page_text)
+        docs.extend(page_docs)
+        embed_tasks.append(
+            asyncio.ensure_future(
+                embeddings.aembed_documents([d.page_content for d in page_docs])
+            )
+        )
+    vectors = [v for batch in await asyncio.gather(*embed_tasks) for v in batch]
+    return docs, vectors
+
+
+def build_vectorstore_for_topic(topic: str, max_pages: int = 3) -> Optional[FAISS]:
+    """Fetch a topic from Wikipedia and build its vectorstore in one
+    pipelined pass, overlapping downloads with embedding.
+
+    Returns None only when the search genuinely finds no content;
+    transient fetch or embedding failures propagate so callers (and
+    st.cache_resource, which does not cache exceptions) can retry
+    instead of pinning an empty result.
+    """
+    docs, vectors = asyncio.run(_gather_topic_vectors(topic, max_pages))
+    if not docs:
+        return None
+    return _vectorstore_from_vectors(docs, vectors)
+
+# --------------------------------------------------------
+# 🔎 Batched Retrieval
+# --------------------------------------------------------
+def batch_retrieve(
+    vectorstore: FAISS, queries: List[str], k: int = 4
+) -> List[List[Document]]:
+    """Retrieve the top-k documents for many queries in one index search.
+
+    All queries are embedded in a single API call and searched as one
+    (n_queries, d) matrix, which FAISS scores with a batched BLAS matmul
+    instead of one scan per query. Useful for multi-agent flows that hit
+    the same index with several queries.
+    """
+    vectors = _get_embeddings().embed_documents(queries)
+    _, ids = vectorstore.index.search(np.asarray(vectors, dtype=np.float32), k)
+    return [
+        [
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+            for i in row
+            if i != -1
+        ]
+        for row in ids
+    ]
+
+
+# --------------------------------------------------------
+# 🗃️ Semantic Prompt Cache
+# --------------------------------------------------------
+# prompt -> (unit-norm embedding, article, source fingerprint), evicted
+# least-recently-used; a hit requires both a cosine-similar prompt and
+# the exact same indexed source
+_semantic_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+def _source_fingerprint(retriever) -> Optional[str]:
+    """Hash the indexed chunk texts behind a retriever.
+
+    Articles generated from different sources (Wikipedia vs uploads)
+    must not satisfy each other's cache lookups, even for the same
+    topic. Returns None when the chunks cannot be reached, in which
+    case callers should bypass the cache.
+    """
+    vectorstore = getattr(retriever, "vectorstore", None)
+    store = getattr(getattr(vectorstore, "docstore", None), "_dict", None)
+    if not store:
+        return None
+    h = hashlib.sha256()
+    for doc_id in sorted(store):
+        h.update(store[doc_id].page_content.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _embed_prompt(prompt: str) -> np.ndarray:
+    vec = np.asarray(_get_embeddings().embed_query(prompt), dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def _semantic_cache_get(query_vec: np.ndarray, source_fp: str) -> Optional[str]:
+    """Return a cached article from the same source whose prompt is
+    cosine-similar enough."""
+    keys = [k for k in _semantic_cache if _semantic_cache[k][2] == source_fp]
+    if not keys:
+        return None
+    sims = np.stack([_semantic_cache[k][0] for k in keys]) @ query_vec
+    best = int(np.argmax(sims))
+    if sims[best] >= SEMANTIC_CACHE_THRESHOLD:
+        _semantic_cache.move_to_end(keys[best])
+        return _semantic_cache[keys[best]][1]
+    return None
+
+
+def _semantic_cache_put(
+    prompt: str, query_vec: np.ndarray, article: str, source_fp: str
+) -> None:
+    _semantic_cache[prompt] = (query_vec, article, source_fp)
+    _semantic_cache.move_to_end(prompt)
+    while len(_semantic_cache) > SEMANTIC_CACHE_SIZE:
+        _semantic_cache.popitem(last=False)
+
+
 # --------------------------------------------------------
 # 📰 Article Generator
 # --------------------------------------------------------
-def generate_article_from_retriever(retriever, topic: str) -> str:
-    """Generate a concise newspaper article based on retrieved content."""
-    llm = ChatOpenAI(model=MODEL, temperature=0.4)
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        chain_type="stuff"
-    )
+# Static system message kept identical across calls and placed first so
+# OpenAI's automatic prompt caching can reuse the processed prefix; the
+# per-request topic goes last in the human message. Automatic caching
+# only engages for prefixes of at least 1024 tokens, so the guide is
+# deliberately written out in full rather than summarized.
+_STYLE_GUIDE = (
+    "You are a veteran newspaper journalist writing for a general-interest "
+    "daily. You have spent two decades on news desks and you write clean, "
+    "disciplined copy that needs no editing. Follow this style guide "
+    "exactly on every assignment.\n\n"
+    "STRUCTURE\n"
+    "- Open with a catchy headline on its own line. No label such as "
+    "'Headline:', no surrounding quotes, no trailing punctuation.\n"
+    "- A good headline is specific and active: it names the subject and "
+    "what happened rather than teasing vaguely. Avoid puns that obscure "
+    "the story and avoid headlines phrased as questions.\n"
+    "- Follow the headline with exactly three paragraphs of 3-5 sentences "
+    "each. Do not add section headings, subheadings, bullet points, pull "
+    "quotes, datelines, bylines, or a sign-off of any kind.\n"
+    "- The first paragraph is the lede: it must answer who, what, where, "
+    "and why it matters, and make the reader want the rest. Put the "
+    "single most newsworthy fact in the first sentence; do not bury it.\n"
+    "- The second paragraph supplies depth: background, key figures, "
+    "history, or mechanics drawn from the supplied context. This is "
+    "where numbers, timelines, and supporting detail belong.\n"
+    "- The third paragraph looks outward: implications, reactions, open "
+    "questions, or what happens next. End on substance, not on a vague "
+    "'time will tell' formula.\n"
+    "- Paragraphs must flow as continuous prose. Each sentence should "
+    "advance the story; cut any sentence that merely restates an "
+    "earlier one in different words.\n\n"
+    "SOURCING AND ACCURACY\n"
+    "- Use only facts present in the supplied context. Never invent "
+    "statistics, quotes, names, dates, places, or events, no matter how "
+    "plausible they seem.\n"
+    "- Do not import outside knowledge that contradicts the context; if "
+    "the context and your general knowledge disagree, the context wins.\n"
+    "- If the context is thin on some aspect of the topic, write around "
+    "the gap rather than speculating. A shorter accurate paragraph "
+    "always beats a fuller invented one.\n"
+    "- Attribute claims neutrally ('according to', 'officials said', "
+    "'the report states') rather than asserting contested points in the "
+    "paper's own voice.\n"
+    "- Direct quotations may be used only if they appear verbatim in the "
+    "context. Never fabricate or paraphrase-as-quote.\n"
+    "- Distinguish clearly between what has happened, what is planned, "
+    "and what is merely proposed or rumored.\n\n"
+    "TONE AND LANGUAGE\n"
+    "- Informative and engaging; professional but not stiff. Write for "
+    "an intelligent reader with no special background in the subject.\n"
+    "- Prefer short declarative sentences and the active voice. One idea "
+    "per sentence. Vary sentence length enough to avoid monotony.\n"
+    "- Avoid jargon, acronyms, and insider shorthand; when a technical "
+    "term is unavoidable, gloss it in plain words on first use and "
+    "expand an acronym the first time it appears.\n"
+    "- No editorializing, no first person singular or plural, no direct "
+    "address of the reader, no rhetorical questions, no exclamation "
+    "marks, and no scare quotes.\n"
+    "- Ban empty intensifiers and cliches: 'very', 'truly', 'game-"
+    "changing', 'groundbreaking', 'at the end of the day', 'in today's "
+    "fast-paced world', 'it remains to be seen', and the like.\n"
+    "- Use concrete verbs over noun constructions: 'the company cut "
+    "prices', not 'the company implemented a price reduction'.\n\n"
+    "NUMBERS, NAMES, AND DATES\n"
+    "- Spell out numbers one through nine; use numerals from 10 upward. "
+    "Use numerals for all percentages, sums of money, and measurements.\n"
+    "- Round large numbers sensibly in running copy ('about 3.2 "
+    "million') unless the precise figure is itself the news.\n"
+    "- Give a person's full name and role on first mention, surname "
+    "alone afterward. Do not use courtesy titles.\n"
+    "- Anchor time references to concrete dates or periods from the "
+    "context ('in March', 'last year') rather than 'recently' or "
+    "'nowadays', and never invent a date the context does not supply.\n"
+    "- Convert or contextualize units when it helps the general reader, "
+    "but only using figures derivable from the context.\n\n"
+    "FAIRNESS AND BALANCE\n"
+    "- Present disputes evenhandedly: state each side's position in "
+    "neutral language and let the facts carry the weight.\n"
+    "- Do not praise or criticize any person, company, product, or "
+    "policy in the paper's own voice; report praise or criticism only "
+    "as attributed claims.\n"
+    "- Avoid loaded adjectives ('controversial', 'notorious', "
+    "'visionary') unless they are attributed to a named source in the "
+    "context.\n"
+    "- Treat all persons with the same register regardless of "
+    "prominence; no fawning and no snark.\n\n"
+    "SELF-CHECK BEFORE SUBMITTING\n"
+    "- Confirm the headline stands on its own line with no label, "
+    "quotes, or trailing punctuation, and that it states the story "
+    "rather than teasing it.\n"
+    "- Count the paragraphs: exactly three, each 3-5 sentences. Merge "
+    "or trim if the draft drifts outside those bounds.\n"
+    "- Re-read the lede and verify the most newsworthy fact appears in "
+    "the first sentence.\n"
+    "- Scan every number, name, date, and quotation and confirm each "
+    "one is traceable to the supplied context.\n"
+    "- Search the draft for banned words and constructions listed above "
+    "and rewrite any sentence that contains one.\n"
+    "- Verify no sentence expresses the paper's own opinion and no "
+    "sentence addresses the reader directly.\n\n"
+    "OUTPUT FORMAT\n"
+    "- Return only the headline and the three paragraphs, separated by "
+    "blank lines.\n"
+    "- No preamble ('Here is the article'), no closing notes, no word "
+    "counts, no markdown formatting, no asterisks or hash marks, and no "
+    "commentary about these instructions or the supplied context.\n"
+    "- Do not mention that the article was generated, that context was "
+    "provided, or that any instructions exist. The reader sees only the "
+    "finished newspaper article."
+)
+
+_ARTICLE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _STYLE_GUIDE),
+    (
+        "human",
+        "Context:\n{context}\n\nTopic: {topic}\n\nWrite the article now.",
+    ),
+])
+
+
+def _format_docs(docs: List[Document]) -> str:
+    return "\n\n".join(d.page_content for d in docs)
+
+
+def generate_article_from_retriever(retriever, topic: str, callbacks=None) -> str:
+    """Generate a concise newspaper article based on retrieved content.
+
+    Pass LangChain callbacks (e.g. a token handler) to stream the
+    response as it is generated.
+    """
+    # Serve near-duplicate prompts from the semantic cache without an LLM
+    # call; entries are scoped to the exact indexed source so a Wikipedia
+    # article never answers for uploaded documents on the same topic
+    source_fp = _source_fingerprint(retriever)
+    cache_key = f"newspaper article about: {topic}"
+    query_vec = None
+    if source_fp is not None:
+        query_vec = _embed_prompt(cache_key)
+        cached = _semantic_cache_get(query_vec, source_fp)
+        if cached is not None:
+            return cached
 
-    prompt = (
-        f"You are a journalist writing a newspaper article about '{topic}'. "
-        "Use the retrieved information to write a catchy headline followed by "
-        "exactly three paragraphs (3-5 sentences each). Keep the tone informative and engaging."
+    # Explicit retriever + prompt chain: the LLM sees only the retrieved
+    # context and our journalism instructions, with none of RetrievalQA's
+    # extra boilerplate tokens
+    chain = (
+        {"context": retriever | _format_docs, "topic": RunnablePassthrough()}
+        | _ARTICLE_PROMPT
+        | _get_llm()
+        | StrOutputParser()
     )
 
-    response = qa_chain.run(prompt)
+    response = chain.invoke(topic, config={"callbacks": callbacks or []})
+    if query_vec is not None:
+        _semantic_cache_put(cache_key, query_vec, response, source_fp)
     return response